@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+""" Bounded worker pool for bcrypt hashing """
+
+from collections import deque
+from concurrent import futures
+from concurrent.futures import (Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+import asyncio
+import os
+import threading
+import time
+
+import bcrypt
+
+
+class _Slots:
+    """ Counting semaphore handing its slots to threads and asyncio tasks
+        alike, in arrival order: a released slot goes to the oldest
+        waiter rather than to whoever asks next.
+    """
+
+    def __init__(self, count: int):
+        """ Starts with count free slots. """
+        self._free = count
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _wait(self) -> Future:
+        """ Takes a free slot and returns None, or queues a waiter whose
+            future is resolved when a slot is handed to it.
+        """
+        with self._lock:
+            if self._free > 0:
+                self._free -= 1
+                return None
+            waiter = Future()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _give_up(self, waiter: Future) -> bool:
+        """ Withdraws a waiter, returns whether it was handed a slot
+            meanwhile, which it then owns.
+        """
+        with self._lock:
+            if waiter.done() and not waiter.cancelled():
+                return True
+            waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            return False
+
+    def acquire(self, timeout: float = None) -> bool:
+        """ Takes a slot, waiting at most timeout seconds. """
+        waiter = self._wait()
+        if waiter is None:
+            return True
+        try:
+            waiter.result(timeout)
+            return True
+        except futures.TimeoutError:
+            return self._give_up(waiter)
+        except BaseException:
+            if self._give_up(waiter):
+                self.release()
+            raise
+
+    async def acquire_async(self, timeout: float = None) -> bool:
+        """ Takes a slot, waiting at most timeout seconds without
+            blocking the event loop. A cancelled caller leaves no slot
+            taken.
+        """
+        waiter = self._wait()
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._give_up(waiter)
+        except BaseException:
+            if self._give_up(waiter):
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """ Hands the slot to the oldest waiter still waiting, or frees
+            it.
+        """
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(True)
+                    return
+            self._free += 1
+
+
+class BcryptPool:
+    """ Runs bcrypt off the request thread on a fixed number of workers.
+        At most workers + max_pending calls are in flight, the others wait
+        up to timeout seconds for a slot, served in arrival order whether
+        they are threads or asyncio tasks.
+        kind is "thread" (bcrypt releases the GIL) or "process".
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = 64,
+                 kind: str = "thread", timeout: float = 30):
+        """ Starts the executor. """
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(self.workers,
+                                                thread_name_prefix="bcrypt")
+        self._slots = _Slots(self.workers + max_pending)
+
+    def _acquire(self) -> None:
+        """ Takes a slot or raises TimeoutError. """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("bcrypt pool queue is full")
+
+    def _submit(self, fn, *args) -> Future:
+        """ Runs fn(*args) on the pool once a slot is taken. """
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hashpw(self, password: bytes, salt: bytes) -> bytes:
+        """ bcrypt.hashpw on the pool. """
+        self._acquire()
+        return self._submit(bcrypt.hashpw, password, salt).result()
+
+    def checkpw(self, password: bytes, hashed_password: bytes) -> bool:
+        """ bcrypt.checkpw on the pool. """
+        self._acquire()
+        return self._submit(bcrypt.checkpw, password, hashed_password
+                            ).result()
+
+    async def _run_async(self, fn, *args):
+        """ Runs fn(*args) on the pool without blocking the event loop. """
+        if not await self._slots.acquire_async(self.timeout):
+            raise TimeoutError("bcrypt pool queue is full")
+        return await asyncio.wrap_future(self._submit(fn, *args))
+
+    async def hashpw_async(self, password: bytes, salt: bytes) -> bytes:
+        """ bcrypt.hashpw on the pool, awaitable. """
+        return await self._run_async(bcrypt.hashpw, password, salt)
+
+    async def checkpw_async(self, password: bytes,
+                            hashed_password: bytes) -> bool:
+        """ bcrypt.checkpw on the pool, awaitable. """
+        return await self._run_async(bcrypt.checkpw, password,
+                                     hashed_password)
+
+    def shutdown(self) -> None:
+        """ Waits for the running calls and stops the workers. """
+        self._executor.shutdown(wait=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> BcryptPool:
+    """ Returns the process wide pool, configured by
+        BCRYPT_POOL_WORKERS (default: number of CPUs),
+        BCRYPT_POOL_QUEUE (default 64), BCRYPT_POOL_TIMEOUT (seconds,
+        default 30) and BCRYPT_POOL_KIND ("thread" or "process").
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BcryptPool(
+                workers=int(os.getenv("BCRYPT_POOL_WORKERS", 0)) or None,
+                max_pending=int(os.getenv("BCRYPT_POOL_QUEUE", 64)),
+                kind=os.getenv("BCRYPT_POOL_KIND", "thread"),
+                timeout=float(os.getenv("BCRYPT_POOL_TIMEOUT", 30))
+            )
+        return _pool
+
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+_rounds = None
+
+
+def hash_time(rounds: int, samples: int = 3) -> float:
+    """ Best of samples durations, in seconds, of one bcrypt hash at
+        rounds.
+    """
+    salt = bcrypt.gensalt(rounds)
+    best = None
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", salt)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate_rounds(target: float, floor: int = MIN_ROUNDS) -> int:
+    """ Highest bcrypt cost whose hash time stays within target seconds,
+        floor at least. Each extra round doubles the time, so costs are
+        measured upwards from floor until one is predicted to exceed
+        target.
+    """
+    rounds = max(floor, MIN_ROUNDS)
+    elapsed = hash_time(rounds)
+    while rounds < MAX_ROUNDS and elapsed * 2 <= target:
+        rounds += 1
+        elapsed = hash_time(rounds, 1)
+    return rounds if elapsed <= target or rounds == max(floor, MIN_ROUNDS) \
+        else rounds - 1
+
+
+def get_rounds() -> int:
+    """ Current bcrypt cost: BCRYPT_ROUNDS if set, else calibrated once
+        against BCRYPT_TARGET_MS if set, never below BCRYPT_MIN_ROUNDS
+        (default 10), else the bcrypt default of 12.
+        Each process calibrates on its own and may measure another cost:
+        deployments running several workers should pin BCRYPT_ROUNDS.
+    """
+    global _rounds
+    if _rounds is None:
+        if os.getenv("BCRYPT_ROUNDS"):
+            _rounds = int(os.getenv("BCRYPT_ROUNDS"))
+        elif os.getenv("BCRYPT_TARGET_MS"):
+            _rounds = calibrate_rounds(
+                float(os.getenv("BCRYPT_TARGET_MS")) / 1000,
+                int(os.getenv("BCRYPT_MIN_ROUNDS", 10)))
+        else:
+            _rounds = 12
+    return _rounds
+
+
+def gensalt() -> bytes:
+    """ bcrypt salt at the current cost. """
+    return bcrypt.gensalt(get_rounds())
+
+
+def rounds_of(hashed_password: bytes) -> int:
+    """ Cost a bcrypt hash was computed with, None if unreadable. """
+    try:
+        return int(hashed_password.split(b"$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    # Benchmark: bcrypt hashes per second and per core at each cost
+    for rounds in range(MIN_ROUNDS, 15):
+        print("cost {:2d}: {:10.2f} hashes/s".format(
+            rounds, 1 / hash_time(rounds, 1 if rounds > 10 else 3)))
+    if os.getenv("BCRYPT_TARGET_MS"):
+        print("calibrated cost for {} ms: {}".format(
+            os.getenv("BCRYPT_TARGET_MS"), get_rounds()))
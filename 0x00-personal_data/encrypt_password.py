@@ -1,16 +1,28 @@
 #!/usr/bin/env python3
 """ Encrypt password """
 
-import bcrypt
+from bcrypt_pool import get_pool, gensalt
 
 
 def hash_password(password: str) -> bytes:
     """ Hashes a password using bcrypt with a generated salt """
     password_bytes = password.encode('utf-8')
-    return bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+    return get_pool().hashpw(password_bytes, gensalt())
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
     """ Checks if the provided password matches the hashed password """
     password_bytes = password.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, hashed_password)
+    return get_pool().checkpw(password_bytes, hashed_password)
+
+
+async def hash_password_async(password: str) -> bytes:
+    """ hash_password without blocking the event loop """
+    password_bytes = password.encode('utf-8')
+    return await get_pool().hashpw_async(password_bytes, gensalt())
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    """ is_valid without blocking the event loop """
+    password_bytes = password.encode('utf-8')
+    return await get_pool().checkpw_async(password_bytes, hashed_password)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+""" Streaming redaction of log files """
+
+from multiprocessing import Pool
+from typing import BinaryIO, Callable, Iterable, List, Tuple
+import argparse
+import os
+import shutil
+
+from filtered_logger import PII_FIELDS, RedactingFormatter, get_redactor
+
+CHUNK_SIZE = 1 << 22
+
+
+def byte_redactor(fields: Iterable[str]) -> Callable[[bytes], bytes]:
+    """ Returns a function redacting the `field=value;` pairs of
+        RedactingFormatter in a block of whole lines.
+    """
+    # Values never run past the end of their line
+    redactor = get_redactor(tuple(fields), RedactingFormatter.REDACTION,
+                            RedactingFormatter.SEPARATOR + "\n")
+
+    def redact(data: bytes) -> bytes:
+        """ Redacts data, non UTF-8 bytes are kept as is. """
+        text = data.decode('utf-8', 'surrogateescape')
+        return redactor.redact(text).encode('utf-8', 'surrogateescape')
+    return redact
+
+
+def redact_range(src_path: str, dst: BinaryIO,
+                 fields: Iterable[str] = PII_FIELDS, start: int = 0,
+                 end: int = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """ Writes to dst the redacted lines of src_path starting in the byte
+        range [start, end), reading chunk_size bytes at a time.
+        Returns the number of bytes read.
+    """
+    redact = byte_redactor(fields)
+    with open(src_path, 'rb') as src:
+        if start > 0:
+            # The line running over start belongs to the previous range
+            src.seek(start - 1)
+            src.readline()
+        pos = src.tell()
+        read = 0
+        while end is None or pos < end:
+            size = chunk_size if end is None else min(chunk_size, end - pos)
+            chunk = src.read(size)
+            if not chunk:
+                break
+            if not chunk.endswith(b"\n"):
+                chunk += src.readline()
+            pos += len(chunk)
+            read += len(chunk)
+            dst.write(redact(chunk))
+    return read
+
+
+def redact_file(src_path: str, dst_path: str,
+                fields: Iterable[str] = PII_FIELDS,
+                chunk_size: int = CHUNK_SIZE) -> int:
+    """ Redacts src_path into dst_path in a single streaming pass.
+        Returns the number of bytes read.
+    """
+    with open(dst_path, 'wb') as dst:
+        return redact_range(src_path, dst, fields, chunk_size=chunk_size)
+
+
+def _redact_part(args: Tuple[str, str, Tuple[str, ...], int, int, int]
+                 ) -> str:
+    """ Pool worker: redacts one byte range into a part file. """
+    src_path, part_path, fields, start, end, chunk_size = args
+    with open(part_path, 'wb') as dst:
+        redact_range(src_path, dst, fields, start, end, chunk_size)
+    return part_path
+
+
+def _redact_whole(args: Tuple[str, str, Tuple[str, ...], int]) -> str:
+    """ Pool worker: redacts one whole file. """
+    src_path, dst_path, fields, chunk_size = args
+    redact_file(src_path, dst_path, fields, chunk_size)
+    return dst_path
+
+
+def redact_file_parallel(src_path: str, dst_path: str,
+                         fields: Iterable[str] = PII_FIELDS,
+                         processes: int = None,
+                         chunk_size: int = CHUNK_SIZE) -> None:
+    """ Redacts src_path into dst_path, splitting it in line aligned byte
+        ranges handled by a pool of processes.
+    """
+    processes = processes or os.cpu_count() or 1
+    size = os.path.getsize(src_path)
+    step = max(-(-size // processes), 1)
+    jobs = [
+        (src_path, "{}.part{}".format(dst_path, i), tuple(fields),
+         start, min(start + step, size), chunk_size)
+        for i, start in enumerate(range(0, size, step))
+    ]
+
+    with Pool(processes) as pool:
+        parts = pool.map(_redact_part, jobs)
+
+    with open(dst_path, 'wb') as dst:
+        for part_path in parts:
+            with open(part_path, 'rb') as part:
+                shutil.copyfileobj(part, dst, chunk_size)
+            os.remove(part_path)
+
+
+def redact_files(paths: Iterable[Tuple[str, str]],
+                 fields: Iterable[str] = PII_FIELDS, processes: int = None,
+                 chunk_size: int = CHUNK_SIZE) -> List[str]:
+    """ Redacts each (src_path, dst_path) pair, one file per process.
+    """
+    jobs = [(src, dst, tuple(fields), chunk_size) for src, dst in paths]
+    with Pool(processes or os.cpu_count() or 1) as pool:
+        return pool.map(_redact_whole, jobs)
+
+
+def main() -> None:
+    """ Redacts the log files given on the command line into
+        `<file><suffix>`: by byte range for a single file,
+        by file otherwise.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-f", "--fields", default=",".join(PII_FIELDS),
+                        help="comma separated fields to redact")
+    parser.add_argument("-j", "--processes", type=int, default=None)
+    parser.add_argument("-s", "--suffix", default=".redacted")
+    parser.add_argument("-c", "--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    fields = tuple(field for field in args.fields.split(",") if field)
+    if len(args.files) == 1:
+        redact_file_parallel(args.files[0], args.files[0] + args.suffix,
+                             fields, args.processes, args.chunk_size)
+    else:
+        redact_files([(path, path + args.suffix) for path in args.files],
+                     fields, args.processes, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,89 @@
 """
 import re
 import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Tuple, TypeVar
 
 from .auth import Auth
 from models.user import User
 
 
+class CredentialCache:
+    """Bounded LRU cache of verified Authorization headers.
+        Headers are keyed by an HMAC digest under a per-process secret, so
+        credentials are never kept in clear. An entry maps to the user id
+        with the email and password hash it was verified against, and is
+        dropped once expired or as soon as that user is removed or its
+        email or password changes.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        """Initializes an empty cache.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, authorization_header: str) -> bytes:
+        """Returns the cache key of an Authorization header.
+        """
+        return hmac.new(self._secret, authorization_header.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def get(self, key: bytes) -> TypeVar('User'):
+        """Returns the user verified for key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+
+        user_id, email, password, expires_at = entry
+        user = User.get(user_id)
+        if expires_at < time.monotonic() or user is None or \
+                user.email != email or user.password != password:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return user
+
+    def put(self, key: bytes, user: TypeVar('User')) -> None:
+        """Records that key was verified for user.
+        """
+        if self.max_size <= 0:
+            return
+        entry = (user.id, user.email, user.password,
+                 time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
 class BasicAuth(Auth):
     """Basic authentication class.
     """
+
+    def __init__(self):
+        """Sets up the verified credential cache from
+            BASIC_AUTH_CACHE_SIZE (0 disables it) and BASIC_AUTH_CACHE_TTL.
+        """
+        try:
+            max_size = int(os.getenv('BASIC_AUTH_CACHE_SIZE', 1024))
+            ttl = float(os.getenv('BASIC_AUTH_CACHE_TTL', 300))
+        except ValueError:
+            max_size, ttl = 1024, 300
+        self.credential_cache = CredentialCache(max_size, ttl)
+
     def extract_base64_authorization_header(
             self,
             authorization_header: str) -> str:
@@ -74,7 +148,18 @@ class BasicAuth(Auth):
         """Retrieves the user from a request.
         """
         auth_header = self.authorization_header(request)
+        if not isinstance(auth_header, str):
+            return None
+
+        cache_key = self.credential_cache.key(auth_header)
+        user = self.credential_cache.get(cache_key)
+        if user is not None:
+            return user
+
         b64_auth_token = self.extract_base64_authorization_header(auth_header)
         auth_token = self.decode_base64_authorization_header(b64_auth_token)
         email, password = self.extract_user_credentials(auth_token)
-        return self.user_object_from_credentials(email, password)
+        user = self.user_object_from_credentials(email, password)
+        if user is not None:
+            self.credential_cache.put(cache_key, user)
+        return user
@@ -2,18 +2,90 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request, url_for
 from models.user import User
+from os import getenv
+from typing import Iterator, List
+import json
+
+
+STREAM_BATCH_SIZE = 1000
+
+
+def _users_json(user_ids: List[str]) -> Iterator[dict]:
+    """ JSON representations of the users of user_ids still existing,
+        fetched STREAM_BATCH_SIZE at a time
+    """
+    for start in range(0, len(user_ids), STREAM_BATCH_SIZE):
+        batch = user_ids[start:start + STREAM_BATCH_SIZE]
+        for user in User.get_many(batch):
+            yield user.to_json()
+
+
+def _stream_json(user_ids: List[str]) -> Iterator[str]:
+    """ Chunks of a JSON list of users
+    """
+    separator = "["
+    for user_json in _users_json(user_ids):
+        yield separator + json.dumps(user_json)
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+def _stream_ndjson(user_ids: List[str]) -> Iterator[str]:
+    """ Lines of newline delimited JSON users
+    """
+    for user_json in _users_json(user_ids):
+        yield json.dumps(user_json) + "\n"
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: page size, USERS_PAGE_SIZE (100) if only cursor is given
+      - cursor: ID of the last User of the previous page
+      - stream: `json` or `ndjson` to stream the response
     Return:
-      - list of all User objects JSON represented
+      - list of all User objects JSON represented, or of a page of
+        them ordered by ID, the next page in a `Link` header
+      - 400 if limit or stream is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    stream = request.args.get('stream')
+    if limit is None and cursor is None and stream is None:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+
+    if limit is None and cursor is not None:
+        limit = getenv('USERS_PAGE_SIZE', 100)
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            return jsonify({'error': "limit must be a positive integer"}), 400
+    if stream not in (None, 'json', 'ndjson'):
+        return jsonify({'error': "stream must be json or ndjson"}), 400
+
+    user_ids = User.ids(cursor, None if limit is None else limit + 1)
+    headers = {}
+    if limit is not None and len(user_ids) > limit:
+        user_ids = user_ids[:limit]
+        args = dict(request.args, limit=limit, cursor=user_ids[-1])
+        headers['Link'] = '<{}>; rel="next"'.format(
+            url_for('app_views.view_all_users', _external=True, **args))
+
+    if stream == 'json':
+        return Response(_stream_json(user_ids), headers=headers,
+                        mimetype='application/json')
+    if stream == 'ndjson':
+        return Response(_stream_ndjson(user_ids), headers=headers,
+                        mimetype='application/x-ndjson')
+    users = [user.to_json() for user in User.get_many(user_ids)]
+    return jsonify(users), 200, headers
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
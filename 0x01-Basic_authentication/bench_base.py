@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+""" Stress test and memory benchmark of the Base object store, run from
+the project directory. The stress test switches to a temporary
+directory and sets STORAGE_MODE for its own process.
+"""
+import gc
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from models.user import User
+
+
+def stress(threads: int, operations: int):
+    """ Concurrent saves, removes, searches and reloads of users by
+        threads threads, operations each, in each storage mode and in a
+        temporary directory. Checks that no operation failed, that every
+        write is kept and that the files hold what memory holds.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for mode in ("snapshot", "journal"):
+                os.environ["STORAGE_MODE"] = mode
+                for name in os.listdir("."):
+                    os.remove(name)
+                User.load_from_file()
+                errors = []
+                kept = {}
+
+                def run(n: int):
+                    """ One thread: saves users, removes one in two and
+                        reads them back, reloading now and then
+                    """
+                    try:
+                        mine = {}
+                        for i in range(operations):
+                            user = User(email="t{}-{}@hbtn.io".format(n, i))
+                            user.save()
+                            mine[user.id] = user.email
+                            if i % 2:
+                                user.remove()
+                                del mine[user.id]
+                            found = User.search({'email': user.email})
+                            if (len(found) == 1) != (user.id in mine):
+                                raise AssertionError(user.email)
+                            if i % 50 == 0:
+                                User.load_if_changed()
+                        kept[n] = mine
+                    except Exception as e:
+                        errors.append(repr(e))
+
+                start = time.perf_counter()
+                workers = [threading.Thread(target=run, args=(n,))
+                           for n in range(threads)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+
+                expected = {}
+                for mine in kept.values():
+                    expected.update(mine)
+                in_memory = {user.id: user.email for user in User.all()}
+                User.load_from_file()
+                on_disk = {user.id: user.email for user in User.all()}
+                ok = not errors and in_memory == expected == on_disk
+                print("{:8s} {} threads x {} ops: {:.2f}s, {} users, "
+                      "{}".format(mode, threads, operations, elapsed,
+                                  len(on_disk), "ok" if ok else "FAILED"))
+                for error in errors[:5]:
+                    print("  " + error)
+        finally:
+            os.environ.pop("STORAGE_MODE", None)
+            os.chdir(cwd)
+
+
+def memory(count: int):
+    """ Memory held per User and per UserSession object, ids included,
+        measured with tracemalloc over count objects built from strings
+        made beforehand
+    """
+    emails = ["user{}@hbtn.io".format(i) for i in range(count)]
+    # Equal user ids read from different records are distinct strings
+    user_ids = ["{:032x}".format(i % 1000) for i in range(count)]
+    builds = [("User", lambda i: User(email=emails[i]))]
+    try:
+        from models.user_session import UserSession
+        builds.append(("UserSession", lambda i: UserSession(
+            user_id=user_ids[i], session_id=emails[i])))
+    except ImportError:
+        pass
+
+    for name, build in builds:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objs = [build(i) for i in range(count)]
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        # The list holding the objects is not part of them
+        used -= sys.getsizeof(objs)
+        print("{:11s} {:6.0f} bytes/object".format(name, used / count))
+        del objs
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "stress":
+        stress(int(sys.argv[2]), int(sys.argv[3]))
+    elif len(sys.argv) == 3 and sys.argv[1] == "memory":
+        memory(int(sys.argv[2]))
+    else:
+        print("Usage: ./bench_base.py stress <threads> <ops>\n"
+              "       ./bench_base.py memory <count>")
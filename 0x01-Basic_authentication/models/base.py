@@ -1,27 +1,214 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import TypeVar, List, Iterable, Iterator, Tuple
+from os import (SEEK_END, chmod, fsync, getenv, path, remove, replace, stat,
+                umask)
+import heapq
 import json
+import sys
+import tempfile
+import threading
 import uuid
 
+from models import snapshot
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
 DATA = {}
+INDEXES = {}
+INDEX_KEYS = {}
+JOURNAL_SIZES = {}
+FILE_STAMPS = {}
+GENERATIONS = {}
+SHARED_GENERATIONS = {}
+LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+_MISSING = object()
+# Read once, setting it is the only way to read it
+_UMASK = umask(0o022)
+umask(_UMASK)
+
+
+class RWLock():
+    """ Readers/writer lock, writers first. Reentrant: the writer may
+        read or write again, a reader may read again.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock shared
+        """
+        me = threading.get_ident()
+        depth = getattr(self._local, 'reads', 0)
+        with self._cond:
+            if depth == 0 and self._writer != me:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+                self._readers += 1
+        self._local.reads = depth + 1
+        try:
+            yield
+        finally:
+            self._local.reads = depth
+            if depth == 0 and self._writer != me:
+                with self._cond:
+                    self._readers -= 1
+                    if self._readers == 0:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock exclusive
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                if getattr(self._local, 'reads', 0) > 0:
+                    raise RuntimeError("Cannot upgrade a read lock")
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._writer_depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer_depth -= 1
+                if self._writer_depth == 0:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+def class_lock(s_class: str) -> RWLock:
+    """ Lock guarding the objects of a class
+    """
+    lock = LOCKS.get(s_class)
+    if lock is None:
+        with _LOCKS_LOCK:
+            lock = LOCKS.setdefault(s_class, RWLock())
+    return lock
+
+
+class SlotField():
+    """ Attribute stored in the slot `_<name>` under another form
+    """
+
+    def __set_name__(self, owner: type, name: str):
+        """ Bind to the slot of the attribute
+        """
+        self.slot = '_' + name
+
+    def __get__(self, obj: TypeVar('Base'), owner: type = None):
+        """ Value of the attribute
+        """
+        if obj is None:
+            return self
+        return self.decode(getattr(obj, self.slot))
+
+    def __set__(self, obj: TypeVar('Base'), value):
+        """ Store a value of the attribute
+        """
+        setattr(obj, self.slot, self.encode(value))
+
+    def encode(self, value):
+        """ Stored form of a value
+        """
+        return value
+
+    def decode(self, value):
+        """ Value of a stored form
+        """
+        return value
+
+    def restore(self, stored):
+        """ Stored form to keep of one read back from a file
+        """
+        return stored
+
+
+class Timestamp(SlotField):
+    """ datetime attribute stored as integer seconds since the epoch
+    """
+
+    def encode(self, value: datetime) -> int:
+        """ Seconds since the epoch of a naive UTC datetime
+        """
+        return None if value is None else (value - EPOCH) // ONE_SECOND
+
+    def decode(self, value: int) -> datetime:
+        """ Naive UTC datetime of seconds since the epoch
+        """
+        return None if value is None else EPOCH + timedelta(seconds=value)
+
+
+class Interned(SlotField):
+    """ str attribute interned, so that objects with equal values share
+        one string
+    """
+
+    def encode(self, value: str) -> str:
+        """ Interned value
+        """
+        return sys.intern(value) if type(value) is str else value
+
+    restore = encode
 
 
 class Base():
     """ Base class
     """
 
+    # Attributes live in slots, subclasses list theirs in __slots__
+    __slots__ = ('id', '_created_at', '_updated_at')
+
+    created_at = Timestamp()
+    updated_at = Timestamp()
+
+    # Slots of the class, the names of their attributes and the
+    # SlotFields wrapping some of them. Set for each subclass.
+    _SLOTS: Tuple[str, ...] = __slots__
+    _FIELDS: Tuple[str, ...] = ('id', 'created_at', 'updated_at')
+    _WRAPPED: dict = {'_created_at': created_at, '_updated_at': updated_at}
+
+    # Attributes resolved through a hash index by `search`
+    INDEXED_ATTRIBUTES: Tuple[str, ...] = ()
+
+    # Snapshot file format: `json` (.db_<Class>.json) or `bin`
+    # (.db_<Class>.bin, see models.snapshot), overridden by the
+    # SNAPSHOT_FORMAT_<Class> variable
+    SNAPSHOT_FORMAT = 'json'
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+            with class_lock(s_class).write():
+                DATA.setdefault(s_class, {})
+                INDEXES.setdefault(s_class, {})
+                INDEX_KEYS.setdefault(s_class, {})
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
@@ -35,6 +222,56 @@ class Base():
         else:
             self.updated_at = datetime.utcnow()
 
+    def __init_subclass__(cls, **kwargs: dict):
+        """ List the attributes stored in the slots of a subclass
+        """
+        super().__init_subclass__(**kwargs)
+        names = {}
+        cls._WRAPPED = {}
+        for klass in cls.__mro__:
+            for name, attr in vars(klass).items():
+                if isinstance(attr, SlotField) and attr.slot not in names:
+                    names[attr.slot] = name
+                    cls._WRAPPED[attr.slot] = attr
+        cls._SLOTS = tuple(
+            slot
+            for klass in reversed(cls.__mro__)
+            for slot in vars(klass).get('__slots__', ())
+        )
+        cls._FIELDS = tuple(names.get(slot, slot) for slot in cls._SLOTS)
+
+    @classmethod
+    def _from_attributes(cls, attrs: dict) -> TypeVar('Base'):
+        """ Object with the given attributes or slots, without going
+            through __init__
+        """
+        obj = cls.__new__(cls)
+        for key, value in attrs.items():
+            field = cls._WRAPPED.get(key)
+            setattr(obj, key, value if field is None else field.restore(value))
+        return obj
+
+    def _state(self) -> dict:
+        """ Stored value of each slot set on the object, and of the
+            attributes of its __dict__ if any
+        """
+        state = {}
+        for slot in self._SLOTS:
+            value = getattr(self, slot, _MISSING)
+            if value is not _MISSING:
+                state[slot] = value
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+    def _attributes(self) -> Iterator[Tuple[str, object]]:
+        """ Name and value of each attribute set on the object
+        """
+        for name in self._FIELDS:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                yield name, value
+        yield from getattr(self, '__dict__', {}).items()
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -48,7 +285,7 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -59,54 +296,374 @@ class Base():
 
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file, then replay the journal.
+            Objects are built aside and swapped in at once.
+            With STORAGE_LAZY=1, a binary snapshot is memory-mapped and
+            its objects decoded on first access.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        generation = GENERATIONS.get(s_class, 0)
+        with cls._file_lock(False) as (_, shared_generation):
+            stamp = cls._file_stamp()
+            data, journal_size = cls._read_files()
+        with class_lock(s_class).write():
+            if GENERATIONS.get(s_class, 0) != generation:
+                # Written meanwhile: read again with writers held off
+                with cls._file_lock(False) as (_, shared_generation):
+                    stamp = cls._file_stamp()
+                    data, journal_size = cls._read_files()
+            cls._swap(data)
+            JOURNAL_SIZES[s_class] = journal_size
+            FILE_STAMPS[s_class] = stamp
+            SHARED_GENERATIONS[s_class] = shared_generation
+
+    @classmethod
+    def _swap(cls, data: dict):
+        """ Replace the objects of the class and their indexes. Lock held.
+        """
+        s_class = cls.__name__
+        DATA[s_class] = data
+        INDEXES[s_class] = {}
+        INDEX_KEYS[s_class] = {}
+        if isinstance(data, snapshot.LazySnapshot):
+            # Objects still as in the snapshot are found by its own index
+            objs = data.changed()
+        else:
+            objs = data.values()
+        for obj in objs:
+            cls._index_add(obj)
+
+    @staticmethod
+    def _shared() -> bool:
+        """ Whether several processes share the files (STORAGE_SHARED=1)
+        """
+        return fcntl is not None and getenv('STORAGE_SHARED') == '1'
+
+    @classmethod
+    @contextmanager
+    def _file_lock(cls, exclusive: bool):
+        """ Advisory lock on the files of the class across processes, in
+            shared storage. Yields the lock file and the generation it
+            holds, bumped by every write of any process.
+        """
+        if not cls._shared():
+            yield None, None
             return
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        with open(".db_{}.lock".format(cls.__name__), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                f.seek(0)
+                try:
+                    generation = int(f.read() or 0)
+                except ValueError:
+                    generation = 0
+                yield f, generation
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    def _sync(cls):
+        """ In shared storage, pick up the writes of other processes
+        """
+        if cls._shared():
+            cls.load_if_changed()
+
+    @classmethod
+    def _read_files(cls) -> Tuple[dict, int]:
+        """ Objects of the snapshot file with the journal replayed on top,
+            and the number of journal records
+        """
+        s_class = cls.__name__
+        data = {}
+        journal_size = 0
+
+        # The snapshot may still be in the other format before the first
+        # save after a format change
+        formats = ['json', 'bin']
+        formats.sort(key=lambda fmt: fmt != cls._snapshot_format())
+        for fmt in formats:
+            file_path = ".db_{}.{}".format(s_class, fmt)
+            if not path.exists(file_path):
+                continue
+            if fmt == 'bin':
+                data = None
+                if getenv('STORAGE_LAZY') == '1':
+                    data = snapshot.load_lazy(file_path, cls)
+                if data is None:
+                    with open(file_path, 'rb') as f:
+                        data = snapshot.load(f, cls)
+            else:
+                with open(file_path, 'r') as f:
+                    objs_json = json.load(f)
+                    for obj_id, obj_json in objs_json.items():
+                        data[obj_id] = cls(**obj_json)
+            break
+
+        journal_path = ".db_{}.journal".format(s_class)
+        if not path.exists(journal_path):
+            return data, journal_size
+
+        with open(journal_path, 'r') as f:
+            torn = None
+            for number, line in enumerate(f, 1):
+                if torn is not None:
+                    raise ValueError("{}: corrupt line {}".format(
+                        journal_path, torn))
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Only the last line may be torn, by an interrupted
+                    # append
+                    torn = number
+                    continue
+                obj_id = record.get('id')
+                if record.get('op') == 'remove':
+                    data.pop(obj_id, None)
+                else:
+                    data[obj_id] = cls(**record.get('obj'))
+                journal_size += 1
+        return data, journal_size
+
+    @classmethod
+    def _snapshot_format(cls) -> str:
+        """ Snapshot file format of the class
+        """
+        return getenv("SNAPSHOT_FORMAT_{}".format(cls.__name__),
+                      cls.SNAPSHOT_FORMAT)
+
+    @classmethod
+    def _file_stamp(cls) -> tuple:
+        """ (inode, mtime, size) of the snapshot and journal files of the
+            class: a snapshot rewritten within one mtime tick at the same
+            size is still a new file
+        """
+        stamp = ()
+        for ext in ("json", "bin", "journal"):
+            try:
+                st = stat(".db_{}.{}".format(cls.__name__, ext))
+                stamp += ((st.st_ino, st.st_mtime_ns, st.st_size),)
+            except OSError:
+                stamp += (None,)
+        return stamp
+
+    @classmethod
+    def load_if_changed(cls) -> bool:
+        """ Reload objects only if the files changed since the last
+            load or write of this process: by generation in shared
+            storage, by (inode, mtime, size) otherwise
+        """
+        s_class = cls.__name__
+        if s_class in FILE_STAMPS:
+            if cls._shared():
+                with cls._file_lock(False) as (_, shared_generation):
+                    pass
+                if SHARED_GENERATIONS.get(s_class) == shared_generation:
+                    return False
+            elif FILE_STAMPS[s_class] == cls._file_stamp():
+                return False
+        cls.load_from_file()
+        return True
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to file and discard the journal
+        """
+        with class_lock(cls.__name__).write():
+            cls._write()
+
+    @classmethod
+    def _save_to_file(cls):
+        """ save_to_file, lock held. The file is written aside then
+            renamed over the former one, so readers never see it torn.
+        """
+        s_class = cls.__name__
+        fmt = cls._snapshot_format()
+        file_path = ".db_{}.{}".format(s_class, fmt)
+
+        fd, tmp_path = tempfile.mkstemp(prefix=file_path + ".",
+                                        suffix=".tmp",
+                                        dir=path.dirname(
+                                            path.abspath(file_path)))
+        try:
+            # mkstemp makes the file owner-only: keep the mode of the
+            # former file, or the one a plain open() would give
+            try:
+                mode = stat(file_path).st_mode & 0o7777
+            except OSError:
+                mode = 0o666 & ~_UMASK
+            chmod(tmp_path, mode)
+            if fmt == 'bin':
+                with open(fd, 'wb') as f:
+                    snapshot.dump(DATA[s_class], f,
+                                  cls.INDEXED_ATTRIBUTES)
+                    f.flush()
+                    fsync(f.fileno())
+            else:
+                objs_json = {}
+                for obj_id, obj in DATA[s_class].items():
+                    objs_json[obj_id] = obj.to_json(True)
+                with open(fd, 'w') as f:
+                    json.dump(objs_json, f)
+                    f.flush()
+                    fsync(f.fileno())
+            replace(tmp_path, file_path)
+        except BaseException:
+            remove(tmp_path)
+            raise
+
+        other_path = ".db_{}.{}".format(
+            s_class, 'json' if fmt == 'bin' else 'bin')
+        if path.exists(other_path):
+            remove(other_path)
+
+        journal_path = ".db_{}.journal".format(s_class)
+        if path.exists(journal_path):
+            remove(journal_path)
+        JOURNAL_SIZES[s_class] = 0
+        FILE_STAMPS[s_class] = cls._file_stamp()
+
+    @classmethod
+    def _write(cls, *records: dict):
+        """ Persist changes: appended to the journal in `journal`
+            storage mode, full snapshot rewrite otherwise. Lock held.
+            In shared storage, the files are locked across processes and
+            changes made by others since our last load are merged first.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        # Bumped on both sides of the write: a load reading the files
+        # meanwhile, even after the first bump, sees a change and reads
+        # them again
+        GENERATIONS[s_class] = GENERATIONS.get(s_class, 0) + 1
+        try:
+            with cls._file_lock(True) as (lock_file, shared_generation):
+                if lock_file is not None:
+                    if SHARED_GENERATIONS.get(s_class) != shared_generation:
+                        cls._merge(records)
+                    lock_file.seek(0)
+                    lock_file.truncate()
+                    lock_file.write(str(shared_generation + 1))
+                    lock_file.flush()
+                    SHARED_GENERATIONS[s_class] = shared_generation + 1
+                cls._append(records)
+        finally:
+            GENERATIONS[s_class] += 1
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _merge(cls, records: Tuple[dict, ...]):
+        """ Reload the files and apply our records on top. Locks held.
+        """
+        s_class = cls.__name__
+        data, journal_size = cls._read_files()
+        for record in records:
+            if record.get('op') == 'remove':
+                data.pop(record.get('id'), None)
+            else:
+                data[record.get('id')] = DATA[s_class][record.get('id')]
+        cls._swap(data)
+        JOURNAL_SIZES[s_class] = journal_size
+
+    @classmethod
+    def _append(cls, records: Tuple[dict, ...]):
+        """ Write records to the journal or the whole snapshot. Locks held.
+        """
+        s_class = cls.__name__
+        if getenv('STORAGE_MODE', 'snapshot') != 'journal' or not records:
+            cls._save_to_file()
+            return
+
+        journal_path = ".db_{}.journal".format(s_class)
+        with open(journal_path, 'ab+') as f:
+            cls._repair_journal(f)
+            f.write("".join(json.dumps(record) + "\n"
+                            for record in records).encode())
+
+        JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + len(records)
+        FILE_STAMPS[s_class] = cls._file_stamp()
+        try:
+            compaction = int(getenv('JOURNAL_COMPACTION', 1000))
+        except ValueError:
+            compaction = 1000
+        if JOURNAL_SIZES[s_class] >= compaction:
+            cls._save_to_file()
+
+    @staticmethod
+    def _repair_journal(f):
+        """ End the journal open in f with a newline, so that appended
+            records start on their own line: a torn last line left by an
+            interrupted append is truncated, a whole one is completed.
+        """
+        end = f.seek(0, SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+        start = end
+        while start > 0:
+            step = min(start, 4096)
+            start -= step
+            f.seek(start)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                start += newline + 1
+                break
+        f.seek(start)
+        tail = f.read()
+        try:
+            json.loads(tail)
+        except ValueError:
+            f.truncate(start)
+            return
+        f.write(b"\n")
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with class_lock(s_class).write():
+            self.updated_at = datetime.utcnow()
+            DATA[s_class][self.id] = self
+            self.__class__._index_remove(self.id)
+            self.__class__._index_add(self)
+            self.__class__._write({
+                'op': 'save', 'id': self.id, 'obj': self.to_json(True)
+            })
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        with class_lock(s_class).write():
+            if DATA[s_class].get(self.id) is not None:
+                del DATA[s_class][self.id]
+                self.__class__._index_remove(self.id)
+                self.__class__._write({'op': 'remove', 'id': self.id})
+
+    @classmethod
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]) -> int:
+        """ Remove several objects with a single write
+        """
+        s_class = cls.__name__
+        records = []
+        with class_lock(s_class).write():
+            for obj in objs:
+                if DATA[s_class].pop(obj.id, None) is not None:
+                    cls._index_remove(obj.id)
+                    records.append({'op': 'remove', 'id': obj.id})
+
+            if len(records) > 0:
+                cls._write(*records)
+        return len(records)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        cls._sync()
+        with class_lock(s_class).read():
+            return len(DATA[s_class].keys())
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -119,7 +676,63 @@ class Base():
         """ Return one object by ID
         """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        cls._sync()
+        with class_lock(s_class).read():
+            return DATA[s_class].get(id)
+
+    @classmethod
+    def get_many(cls, ids: Iterable[str]) -> List[TypeVar('Base')]:
+        """ Return the objects of the IDs that exist, in order
+        """
+        s_class = cls.__name__
+        cls._sync()
+        with class_lock(s_class).read():
+            objs = (DATA[s_class].get(obj_id) for obj_id in ids)
+            return [obj for obj in objs if obj is not None]
+
+    @classmethod
+    def ids(cls, after: str = None, limit: int = None) -> List[str]:
+        """ Return the IDs in ascending order, only those greater than
+            `after` if given, at most `limit` if given
+        """
+        s_class = cls.__name__
+        cls._sync()
+        with class_lock(s_class).read():
+            obj_ids = DATA[s_class].keys()
+            if after is not None:
+                obj_ids = (obj_id for obj_id in obj_ids if obj_id > after)
+            if limit is None:
+                return sorted(obj_ids)
+            return heapq.nsmallest(limit, obj_ids)
+
+    @classmethod
+    def _index_add(cls, obj: TypeVar('Base')):
+        """ Register an object in the indexes of its class. Lock held.
+        """
+        s_class = cls.__name__
+        keys = {}
+        for attr in cls.INDEXED_ATTRIBUTES:
+            value = getattr(obj, attr, None)
+            try:
+                bucket = INDEXES[s_class].setdefault(attr, {})
+                bucket.setdefault(value, {})[obj.id] = obj
+            except TypeError:
+                continue
+            keys[attr] = value
+        INDEX_KEYS[s_class][obj.id] = keys
+
+    @classmethod
+    def _index_remove(cls, obj_id: str):
+        """ Drop an object from the indexes of its class. Lock held.
+        """
+        s_class = cls.__name__
+        keys = INDEX_KEYS[s_class].pop(obj_id, {})
+        for attr, value in keys.items():
+            bucket = INDEXES[s_class][attr]
+            objs = bucket.get(value, {})
+            objs.pop(obj_id, None)
+            if len(objs) == 0:
+                bucket.pop(value, None)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
@@ -133,5 +746,21 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        cls._sync()
+        with class_lock(s_class).read():
+            objs = DATA[s_class].values()
+            for k, v in attributes.items():
+                if k not in cls.INDEXED_ATTRIBUTES:
+                    continue
+                try:
+                    objs = list(INDEXES[s_class].get(k, {}).get(v, {})
+                                .values())
+                    if isinstance(DATA[s_class], snapshot.LazySnapshot):
+                        objs += [DATA[s_class][obj_id]
+                                 for obj_id in DATA[s_class].find(k, v)]
+                except TypeError:
+                    continue
+                break
+
+            return list(filter(_search, objs))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+""" Password hashing module
+"""
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from os import getenv, urandom
+import hashlib
+import hmac
+import threading
+import time
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+
+def _sha256(pwd: str) -> str:
+    """ Legacy scheme: unsalted SHA256 hex digest, stored unprefixed
+    """
+    return hashlib.sha256(pwd.encode()).hexdigest().lower()
+
+
+def _scrypt(pwd: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    """ scrypt key of a password
+    """
+    return hashlib.scrypt(pwd.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + (1 << 20), dklen=32)
+
+
+def hash_password(pwd: str, scheme: str = None) -> str:
+    """ Hash of a password, prefixed by its scheme: `sha256`
+        (legacy, no prefix), `scrypt` or `bcrypt`.
+        The scheme defaults to PASSWORD_SCHEME, itself `scrypt`.
+    """
+    scheme = scheme or getenv('PASSWORD_SCHEME', 'scrypt')
+    if scheme == 'sha256':
+        return _sha256(pwd)
+    if scheme == 'bcrypt':
+        if bcrypt is None:
+            raise ValueError("bcrypt is not installed")
+        rounds = int(getenv('PASSWORD_BCRYPT_ROUNDS', 12))
+        hashed = bcrypt.hashpw(pwd.encode(), bcrypt.gensalt(rounds))
+        return "bcrypt${}".format(hashed.decode())
+    if scheme == 'scrypt':
+        n = int(getenv('PASSWORD_SCRYPT_N', 1 << 14))
+        r = int(getenv('PASSWORD_SCRYPT_R', 8))
+        p = int(getenv('PASSWORD_SCRYPT_P', 1))
+        salt = urandom(16)
+        return "scrypt${}${}${}${}${}".format(
+            n, r, p, b64encode(salt).decode(),
+            b64encode(_scrypt(pwd, salt, n, r, p)).decode())
+    raise ValueError("Unknown password scheme: {}".format(scheme))
+
+
+def scheme_of(hashed: str) -> str:
+    """ Scheme of a stored hash
+    """
+    if '$' not in hashed:
+        return 'sha256'
+    return hashed.split('$', 1)[0]
+
+
+def needs_rehash(hashed: str) -> bool:
+    """ Whether a stored hash was made with another scheme than the
+        current one
+    """
+    return scheme_of(hashed) != getenv('PASSWORD_SCHEME', 'scrypt')
+
+
+class _VerifiedCache:
+    """ Bounded LRU of (hash, password) pairs verified recently, keyed by
+        an HMAC digest under a per-process secret
+    """
+
+    def __init__(self):
+        """ Initialize an empty cache
+        """
+        self.max_size = int(getenv('PASSWORD_CACHE_SIZE', 1024))
+        self.ttl = float(getenv('PASSWORD_CACHE_TTL', 300))
+        self._secret = urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, pwd: str, hashed: str) -> bytes:
+        """ Cache key of a pair
+        """
+        msg = hashed.encode() + b'\0' + pwd.encode()
+        return hmac.new(self._secret, msg, hashlib.sha256).digest()
+
+    def hit(self, key: bytes) -> bool:
+        """ Whether the pair of key was verified less than ttl ago
+        """
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key: bytes):
+        """ Record a verified pair
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+_verified = _VerifiedCache()
+
+
+def verify_password(pwd: str, hashed: str) -> bool:
+    """ Check a password against a stored hash of any scheme
+    """
+    key = _verified.key(pwd, hashed)
+    if _verified.hit(key):
+        return True
+
+    scheme = scheme_of(hashed)
+    if scheme == 'sha256':
+        valid = hmac.compare_digest(_sha256(pwd), hashed)
+    elif scheme == 'bcrypt' and bcrypt is not None:
+        valid = bcrypt.checkpw(pwd.encode(), hashed[len('bcrypt$'):].encode())
+    elif scheme == 'scrypt':
+        try:
+            _, n, r, p, salt, key_b64 = hashed.split('$')
+            expected = b64decode(key_b64)
+            valid = hmac.compare_digest(
+                _scrypt(pwd, b64decode(salt), int(n), int(r), int(p)),
+                expected)
+        except ValueError:
+            valid = False
+    else:
+        valid = False
+
+    if valid:
+        _verified.add(key)
+    return valid
+
+
+if __name__ == "__main__":
+    # Benchmark: password checks per second for each scheme, on a cold
+    # cache (every request pays the KDF) and a warm one
+    for scheme in ('sha256', 'scrypt', 'bcrypt'):
+        if scheme == 'bcrypt' and bcrypt is None:
+            continue
+        hashed = hash_password("benchmark", scheme)
+        for label, warm in (("cold", False), ("warm", True)):
+            count, start = 0, time.perf_counter()
+            while time.perf_counter() - start < 1:
+                if not warm:
+                    _verified._entries.clear()
+                verify_password("benchmark", hashed)
+                count += 1
+            print("{:7s} {}: {:10.1f} checks/s".format(
+                scheme, label, count / (time.perf_counter() - start)))
@@ -3,9 +3,12 @@
 """
 
 import uuid
+from datetime import datetime
+from os import getenv
 
 from models.user import User
 from .auth import Auth
+from .session_store import session_store
 
 
 class SessionAuth(Auth):
@@ -15,24 +18,51 @@ class SessionAuth(Auth):
     # Class attribute to store session IDs and corresponding user IDs
     user_id_by_session_id = {}
 
+    # Session store used when SESSION_STORE is not set
+    SESSION_STORE = "memory"
+
+    # Lifetime of sessions in seconds, 0 if they never expire
+    session_duration = 0
+
+    def __init__(self):
+        """Selects the session store from the SESSION_STORE variable.
+        """
+        self.session_store = session_store(
+            getenv("SESSION_STORE", self.SESSION_STORE),
+            self.user_id_by_session_id,
+            self.session_duration
+        )
+
     def create_session(self, user_id: str = None) -> str:
         """Creates a session ID for a user_id
-            and stores it in the user_id_by_session_id dictionary.
+            and stores it in the session store.
         """
         if user_id is None or not isinstance(user_id, str):
             return None
 
         session_id = str(uuid.uuid4())
-        self.user_id_by_session_id[session_id] = user_id
+        created_at = datetime.utcnow()
+        self.session_store.save(session_id, user_id, created_at,
+                                self._expires_at(created_at))
         return session_id
 
+    def _expires_at(self, created_at: datetime) -> datetime:
+        """Expiration time of a session created at created_at, None if
+            sessions never expire.
+        """
+        return None
+
     def user_id_for_session_id(self, session_id: str = None) -> str:
         """Retrieves the user ID associated with the given session ID.
         """
         if session_id is None or not isinstance(session_id, str):
             return None
 
-        return self.user_id_by_session_id.get(session_id)
+        session = self.session_store.get(session_id)
+        if session is None:
+            return None
+
+        return session.get('user_id')
 
     def current_user(self, request=None):
         """Retrieve a User instance based on the session cookie"""
@@ -56,8 +86,4 @@ class SessionAuth(Auth):
         if user_id is None:
             return False
 
-        if session_id in self.user_id_by_session_id:
-            del self.user_id_by_session_id[session_id]
-            return True
-
-        return False
+        return self.session_store.delete(session_id)
@@ -3,8 +3,8 @@
 """
 
 from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_reaper import SessionReaper
 from datetime import datetime, timedelta
-from models.user import User
 from os import getenv
 
 
@@ -22,23 +22,30 @@ class SessionExpAuth(SessionAuth):
         except Exception:
             session_duration = 0
 
+        # Read by the session store for sessions saved without expires_at
         self.session_duration = session_duration
+        super().__init__()
+        self.expired = 0
+        self.reaper = None
 
-    def create_session(self, user_id=None):
-        """Creation session with expiration
+        try:
+            reap_interval = float(getenv('SESSION_REAP_INTERVAL', 60))
+            reap_batch = int(getenv('SESSION_REAP_BATCH', 1000))
+        except ValueError:
+            reap_interval, reap_batch = 60, 1000
+
+        if session_duration > 0 and reap_interval > 0 and reap_batch > 0:
+            self.reaper = SessionReaper(self.session_store, reap_interval,
+                                        reap_batch)
+            self.reaper.start()
+
+    def _expires_at(self, created_at):
+        """Expiration time of a session created at created_at
         """
-
-        session_id = super().create_session(user_id)
-        if session_id is None:
+        if self.session_duration <= 0:
             return None
 
-        session_dictionary = {
-            "user_id": user_id,
-            "created_at": datetime.now()
-        }
-
-        self.user_id_by_session_id[session_id] = session_dictionary
-        return session_id
+        return created_at + timedelta(seconds=self.session_duration)
 
     def user_id_for_session_id(self, session_id=None):
         """gets user_id from session_id
@@ -47,10 +54,7 @@ class SessionExpAuth(SessionAuth):
         if session_id is None:
             return None
 
-        if session_id not in self.user_id_by_session_id.keys():
-            return None
-
-        session_dictionary = self.user_id_by_session_id.get(session_id)
+        session_dictionary = self.session_store.get(session_id)
         if session_dictionary is None:
             return None
 
@@ -62,7 +66,19 @@ class SessionExpAuth(SessionAuth):
             return None
 
         expired_time = created_at + timedelta(seconds=self.session_duration)
-        if expired_time < datetime.now():
+        if expired_time < datetime.utcnow():
+            self.expired += 1
+            self.session_store.delete(session_id)
             return None
 
         return session_dictionary.get('user_id')
+
+    def session_metrics(self) -> dict:
+        """Number of live sessions, of sessions found expired on lookup
+            and of sessions deleted by the reaper.
+        """
+        return {
+            "live": self.session_store.count(),
+            "expired": self.expired,
+            "reaped": self.reaper.reaped if self.reaper is not None else 0
+        }
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Background eviction of expired sessions.
+"""
+from datetime import datetime
+import threading
+
+from .session_store import SessionStore
+
+
+class SessionReaper(threading.Thread):
+    """Daemon thread deleting expired sessions from a session store
+        every `interval` seconds, in batches of `batch_size`.
+    """
+
+    def __init__(self, store: SessionStore, interval: float,
+                 batch_size: int = 1000):
+        """Initializes the reaper, call start() to run it.
+        """
+        super().__init__(name="session-reaper", daemon=True)
+        self.store = store
+        self.interval = interval
+        self.batch_size = batch_size
+        self.reaped = 0
+        self._stopped = threading.Event()
+
+    def reap(self) -> int:
+        """Deletes every session expired now, returns the number deleted.
+        """
+        now = datetime.utcnow()
+        total = 0
+        while True:
+            deleted = self.store.delete_expired(now, self.batch_size)
+            total += deleted
+            if deleted < self.batch_size:
+                break
+        self.reaped += total
+        return total
+
+    def run(self) -> None:
+        """Reaps until stop() is called.
+        """
+        while not self._stopped.wait(self.interval):
+            try:
+                self.reap()
+            except Exception:
+                # A failed pass is retried on the next interval
+                continue
+
+    def stop(self) -> None:
+        """Stops the reaper after the current pass.
+        """
+        self._stopped.set()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""Session storage backends for the SessionAuth family.
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from os import getenv
+from typing import List, Tuple
+import heapq
+import sqlite3
+import threading
+
+from models.user_session import UserSession
+
+
+class SessionStore(ABC):
+    """Interface of a session storage backend.
+        A session record is a dict with `user_id`, `created_at` and
+        `expires_at` (naive UTC datetimes, `expires_at` may be None).
+        Records without `expires_at`, saved before it was stored, expire
+        `default_ttl` seconds after `created_at` (never if 0).
+    """
+
+    default_ttl = 0
+
+    def _expires_at(self, expires_at: datetime,
+                    created_at: datetime) -> datetime:
+        """Expiration time of a record, None if it never expires.
+        """
+        if expires_at is None and created_at is not None and \
+                self.default_ttl > 0:
+            return created_at + timedelta(seconds=self.default_ttl)
+        return expires_at
+
+    @abstractmethod
+    def save(self, session_id: str, user_id: str, created_at: datetime,
+             expires_at: datetime = None) -> None:
+        """Stores a session record.
+        """
+
+    @abstractmethod
+    def get(self, session_id: str) -> dict:
+        """Returns the session record of session_id or None.
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """Deletes a session record, returns False if it did not exist.
+        """
+
+    @abstractmethod
+    def count(self) -> int:
+        """Returns the number of stored sessions.
+        """
+
+    @abstractmethod
+    def delete_expired(self, now: datetime, limit: int) -> int:
+        """Deletes at most limit sessions expired at now,
+            returns the number deleted: less than limit only when no
+            expired session is left.
+        """
+
+
+class TTLIndex:
+    """Min-heap of (expires_at, session_id). Entries of sessions deleted
+        or re-saved in the meantime are left in place and must be checked
+        by the caller when popped.
+    """
+
+    def __init__(self):
+        """Initializes an empty index.
+        """
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def push(self, expires_at: datetime, session_id: str) -> None:
+        """Adds a session, ignored if it never expires.
+        """
+        if expires_at is None:
+            return
+        with self._lock:
+            heapq.heappush(self._heap, (expires_at, session_id))
+
+    def pop_expired(self, now: datetime,
+                    limit: int) -> List[Tuple[datetime, str]]:
+        """Pops at most limit entries expired at now.
+        """
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and \
+                    len(expired) < limit:
+                expired.append(heapq.heappop(self._heap))
+        return expired
+
+    def clear(self) -> None:
+        """Removes all entries.
+        """
+        with self._lock:
+            self._heap = []
+
+
+class MemorySessionStore(SessionStore):
+    """Session records kept in a dict of the current process.
+    """
+
+    def __init__(self, sessions: dict = None, default_ttl: int = 0):
+        """Uses `sessions` as backing dict so it can be shared.
+        """
+        self.sessions = sessions if sessions is not None else {}
+        self.default_ttl = default_ttl
+        self.ttl_index = TTLIndex()
+        for session_id, session in list(self.sessions.items()):
+            self.ttl_index.push(self._expires_at(session.get("expires_at"),
+                                                 session.get("created_at")),
+                                session_id)
+
+    def save(self, session_id: str, user_id: str, created_at: datetime,
+             expires_at: datetime = None) -> None:
+        """Stores a session record.
+        """
+        self.sessions[session_id] = {
+            "user_id": user_id,
+            "created_at": created_at,
+            "expires_at": expires_at
+        }
+        self.ttl_index.push(self._expires_at(expires_at, created_at),
+                            session_id)
+
+    def get(self, session_id: str) -> dict:
+        """Returns the session record of session_id or None.
+        """
+        return self.sessions.get(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        """Deletes a session record, returns False if it did not exist.
+        """
+        return self.sessions.pop(session_id, None) is not None
+
+    def count(self) -> int:
+        """Returns the number of stored sessions.
+        """
+        return len(self.sessions)
+
+    def delete_expired(self, now: datetime, limit: int) -> int:
+        """Deletes at most limit sessions expired at now,
+            returns the number deleted.
+        """
+        deleted = 0
+        # Entries of sessions deleted or re-saved meanwhile do not count
+        while deleted < limit:
+            popped = self.ttl_index.pop_expired(now, limit - deleted)
+            if not popped:
+                break
+            for expires_at, session_id in popped:
+                session = self.sessions.get(session_id)
+                if session is not None and self._expires_at(
+                        session.get("expires_at"),
+                        session.get("created_at")) == expires_at:
+                    self.sessions.pop(session_id, None)
+                    deleted += 1
+        return deleted
+
+
+class FileSessionStore(SessionStore):
+    """Session records persisted as UserSession objects in the JSON
+        file store.
+    """
+
+    def __init__(self, default_ttl: int = 0):
+        """Initializes the TTL index, built on first use.
+        """
+        self.default_ttl = default_ttl
+        self.ttl_index = TTLIndex()
+        self._indexed = False
+
+    def _refresh(self) -> None:
+        """Reloads the sessions if their files changed and rebuilds the
+            TTL index from them.
+        """
+        if not UserSession.load_if_changed() and self._indexed:
+            return
+
+        self.ttl_index.clear()
+        for user_session in UserSession.all():
+            self.ttl_index.push(self._expires_at(user_session.expires_at,
+                                                 user_session.created_at),
+                                user_session.session_id)
+        self._indexed = True
+
+    def save(self, session_id: str, user_id: str, created_at: datetime,
+             expires_at: datetime = None) -> None:
+        """Stores a session record, replacing the one of session_id if
+            any.
+        """
+        self._refresh()
+        user_sessions = UserSession.search({'session_id': session_id})
+        if user_sessions:
+            user_session = user_sessions[0]
+            user_session.user_id = user_id
+            if len(user_sessions) > 1:
+                UserSession.remove_many(user_sessions[1:])
+        else:
+            user_session = UserSession(user_id=user_id,
+                                       session_id=session_id)
+        user_session.created_at = created_at
+        user_session.expires_at = expires_at
+        user_session.save()
+        # Stored to the second, as compared by delete_expired
+        self.ttl_index.push(self._expires_at(user_session.expires_at,
+                                             user_session.created_at),
+                            session_id)
+
+    def get(self, session_id: str) -> dict:
+        """Returns the session record of session_id or None.
+        """
+        self._refresh()
+        user_sessions = UserSession.search({'session_id': session_id})
+        if not user_sessions:
+            return None
+
+        return {
+            "user_id": user_sessions[0].user_id,
+            "created_at": user_sessions[0].created_at,
+            "expires_at": user_sessions[0].expires_at
+        }
+
+    def delete(self, session_id: str) -> bool:
+        """Deletes a session record, returns False if it did not exist.
+        """
+        self._refresh()
+        user_sessions = UserSession.search({'session_id': session_id})
+        if not user_sessions:
+            return False
+
+        # Duplicates saved before records were replaced go as well
+        UserSession.remove_many(user_sessions)
+        return True
+
+    def count(self) -> int:
+        """Returns the number of stored sessions.
+        """
+        self._refresh()
+        return UserSession.count()
+
+    def delete_expired(self, now: datetime, limit: int) -> int:
+        """Deletes at most limit sessions expired at now with a single
+            write, returns the number deleted.
+        """
+        self._refresh()
+        expired = []
+        # Entries of sessions deleted or re-saved meanwhile do not count
+        while len(expired) < limit:
+            popped = self.ttl_index.pop_expired(now, limit - len(expired))
+            if not popped:
+                break
+            for expires_at, session_id in popped:
+                for user_session in UserSession.search(
+                        {'session_id': session_id}):
+                    if self._expires_at(user_session.expires_at,
+                                        user_session.created_at) == \
+                            expires_at:
+                        expired.append(user_session)
+        return UserSession.remove_many(expired)
+
+
+def _to_epoch(value: datetime) -> float:
+    """Converts a naive UTC datetime to an epoch timestamp.
+    """
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _from_epoch(value: float) -> datetime:
+    """Converts an epoch timestamp to a naive UTC datetime.
+    """
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session records in a SQLite database in WAL mode, shareable by
+        several worker processes.
+    """
+
+    def __init__(self, db_path: str, default_ttl: int = 0):
+        """Creates the sessions table and its indexes if missing.
+        """
+        self.db_path = db_path
+        self.default_ttl = default_ttl
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, "
+            "user_id TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "expires_at REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_expires_at "
+            "ON sessions (expires_at)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None,
+                                   timeout=5)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, session_id: str, user_id: str, created_at: datetime,
+             expires_at: datetime = None) -> None:
+        """Stores a session record.
+        """
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sessions "
+            "(session_id, user_id, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?)",
+            (session_id, user_id, _to_epoch(created_at),
+             _to_epoch(expires_at))
+        )
+
+    def get(self, session_id: str) -> dict:
+        """Returns the session record of session_id or None.
+        """
+        row = self._connection().execute(
+            "SELECT user_id, created_at, expires_at FROM sessions "
+            "WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        return {
+            "user_id": row[0],
+            "created_at": _from_epoch(row[1]),
+            "expires_at": _from_epoch(row[2])
+        }
+
+    def delete(self, session_id: str) -> bool:
+        """Deletes a session record, returns False if it did not exist.
+        """
+        cursor = self._connection().execute(
+            "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+        )
+        return cursor.rowcount > 0
+
+    def count(self) -> int:
+        """Returns the number of stored sessions.
+        """
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sessions"
+        ).fetchone()[0]
+
+    def delete_expired(self, now: datetime, limit: int) -> int:
+        """Deletes at most limit sessions expired at now,
+            returns the number deleted.
+        """
+        created_before = None
+        if self.default_ttl > 0:
+            created_before = _to_epoch(now) - self.default_ttl
+        cursor = self._connection().execute(
+            "DELETE FROM sessions WHERE session_id IN ("
+            "SELECT session_id FROM sessions WHERE expires_at <= ? "
+            "UNION ALL SELECT session_id FROM sessions "
+            "WHERE expires_at IS NULL AND created_at <= ? LIMIT ?)",
+            (_to_epoch(now), created_before, limit)
+        )
+        return cursor.rowcount
+
+
+def session_store(store_type: str, sessions: dict = None,
+                  default_ttl: int = 0) -> SessionStore:
+    """Builds the session store named by store_type:
+        `memory` (over `sessions`), `file` or `sqlite`
+        (at SESSION_STORE_PATH).
+    """
+    if store_type == "file":
+        return FileSessionStore(default_ttl)
+    if store_type == "sqlite":
+        db_path = getenv("SESSION_STORE_PATH", ".db_sessions.sqlite")
+        return SQLiteSessionStore(db_path, default_ttl)
+    return MemorySessionStore(sessions, default_ttl)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+""" Binary snapshot module: compact encoding of model objects
+
+Layout, little endian:
+    magic "BDB1", field count (u16), each field name (u16 length + utf-8),
+    record count (u32), then per record its attribute count (u16) and
+    per attribute: field index (u16), type tag (u8), value.
+Values are: str as u32 length + utf-8, int as i64, float as f64,
+datetime as i64 epoch seconds, booleans and None in the tag alone,
+anything else as a JSON str.
+The records may be followed by an index for lazy loading: a JSON object
+with the ids, record offsets and indexed attribute values, its offset
+(u64) and the magic "BIX1".
+"""
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from typing import (BinaryIO, Iterable, Iterator, List, Optional, Tuple,
+                    TypeVar)
+import json
+import mmap
+import struct
+import threading
+
+
+MAGIC = b"BDB1"
+INDEX_MAGIC = b"BIX1"
+NONE, STR, INT, FLOAT, TRUE, FALSE, DATETIME, JSON = range(8)
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_U64 = struct.Struct("<Q")
+_F64 = struct.Struct("<d")
+_ATTR = struct.Struct("<HB")
+
+
+class LazySnapshot(MutableMapping):
+    """ Objects of a memory-mapped binary snapshot by id, each decoded on
+        first access. Objects set afterwards are held as is.
+        Records still current are found by indexed value through the
+        snapshot index: per attribute, the last position of each value
+        and, per position, the previous one with the same value.
+    """
+
+    def __init__(self, buf: mmap.mmap, cls: type, names: List[str],
+                 body: int, index: dict):
+        """ Initialize from the header and index of the snapshot
+        """
+        self.names = names
+        self._buf = buf
+        self._cls = cls
+        self._body = body
+        self._ids = index['ids']
+        self._offsets = array('q', index['offsets'])
+        self._positions = dict(zip(self._ids, range(len(self._ids))))
+        self._keys = {}
+        self._heads = {}
+        self._chains = {}
+        for attr in cls.INDEXED_ATTRIBUTES:
+            values = self._keys[attr] = index['keys'][attr]
+            heads = self._heads[attr] = {}
+            chain = self._chains[attr] = array('q')
+            for i, value in enumerate(values):
+                chain.append(heads.get(value, -1))
+                heads[value] = i
+        self._objs = {}
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Object by id, decoded if needed
+        """
+        obj = self._changed.get(obj_id) or self._objs.get(obj_id)
+        if obj is not None:
+            return obj
+        with self._lock:
+            obj = self._objs.get(obj_id)
+            if obj is None:
+                i = self._positions[obj_id]
+                attrs, _ = _record(self._buf, self._body + self._offsets[i],
+                                   self.names)
+                obj = self._cls._from_attributes(attrs)
+                self._objs[obj_id] = obj
+            return obj
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Set an object, its record is no longer current
+        """
+        with self._lock:
+            if self._positions.pop(obj_id, None) is not None:
+                self._objs.pop(obj_id, None)
+            self._changed[obj_id] = obj
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object
+        """
+        with self._lock:
+            if self._positions.pop(obj_id, None) is None:
+                del self._changed[obj_id]
+            else:
+                self._objs.pop(obj_id, None)
+
+    def __contains__(self, obj_id: str) -> bool:
+        """ Whether an object exists, without decoding it
+        """
+        return obj_id in self._positions or obj_id in self._changed
+
+    def __iter__(self) -> Iterator[str]:
+        """ Ids of the objects, current records first
+        """
+        with self._lock:
+            obj_ids = list(self._positions) + list(self._changed)
+        return iter(obj_ids)
+
+    def __len__(self) -> int:
+        """ Number of objects
+        """
+        return len(self._positions) + len(self._changed)
+
+    def find(self, attr: str, value) -> List[str]:
+        """ Ids of the objects with a current record whose indexed
+            attribute attr is value
+        """
+        obj_ids = []
+        chain = self._chains[attr]
+        i = self._heads[attr].get(value, -1)
+        while i >= 0:
+            obj_id = self._ids[i]
+            if self._positions.get(obj_id) == i:
+                obj_ids.append(obj_id)
+            i = chain[i]
+        return obj_ids
+
+    def changed(self) -> List[TypeVar('Base')]:
+        """ Objects set since the snapshot was mapped
+        """
+        with self._lock:
+            return list(self._changed.values())
+
+    def current(self) -> Iterator[Tuple[str, bytes, dict]]:
+        """ Id, raw record and indexed values of each object whose record
+            is current
+        """
+        with self._lock:
+            positions = list(self._positions.items())
+        for obj_id, i in positions:
+            yield (obj_id,
+                   self._buf[self._body + self._offsets[i]:
+                             self._body + self._offsets[i + 1]],
+                   {attr: values[i] for attr, values in self._keys.items()})
+
+
+def dump(objs: dict, f: BinaryIO, keys: Iterable[str] = ()):
+    """ Write the objects of a dict by id to a binary snapshot file,
+        indexed by the attributes keys. Records a LazySnapshot did not
+        decode are copied as is.
+    """
+    fields = {}
+    raws = ()
+    if isinstance(objs, LazySnapshot):
+        fields = {name: index for index, name in enumerate(objs.names)}
+        raws = objs.current()
+        objs = objs.changed()
+    else:
+        objs = objs.values()
+
+    body = bytearray()
+    ids = []
+    offsets = []
+    columns = {attr: [] for attr in keys}
+    for obj_id, record, values in raws:
+        ids.append(obj_id)
+        offsets.append(len(body))
+        body += record
+        for attr, column in columns.items():
+            column.append(values.get(attr))
+    for obj in objs:
+        ids.append(obj.id)
+        offsets.append(len(body))
+        for attr, column in columns.items():
+            column.append(getattr(obj, attr, None))
+        attrs = obj._state()
+        body += _U16.pack(len(attrs))
+        for key, value in attrs.items():
+            index = fields.get(key)
+            if index is None:
+                index = fields[key] = len(fields)
+            if value is None:
+                body += _ATTR.pack(index, NONE)
+            elif type(value) is str:
+                data = value.encode()
+                body += _ATTR.pack(index, STR) + _U32.pack(len(data)) + data
+            elif value is True or value is False:
+                body += _ATTR.pack(index, TRUE if value else FALSE)
+            elif type(value) is int:
+                body += _ATTR.pack(index, INT) + _I64.pack(value)
+            elif type(value) is float:
+                body += _ATTR.pack(index, FLOAT) + _F64.pack(value)
+            elif type(value) is datetime:
+                body += _ATTR.pack(index, DATETIME) + \
+                    _I64.pack((value - EPOCH) // ONE_SECOND)
+            else:
+                data = json.dumps(value).encode()
+                body += _ATTR.pack(index, JSON) + _U32.pack(len(data)) + data
+    offsets.append(len(body))
+
+    header = bytearray(MAGIC)
+    header += _U16.pack(len(fields))
+    for key in fields:
+        data = key.encode()
+        header += _U16.pack(len(data)) + data
+    header += _U32.pack(len(ids))
+    f.write(header)
+    f.write(body)
+
+    try:
+        index = json.dumps({'ids': ids, 'offsets': offsets,
+                            'keys': columns}).encode()
+    except (TypeError, ValueError):
+        # Indexed values JSON cannot hold: loaded eagerly
+        return
+    f.write(index)
+    f.write(_U64.pack(len(header) + len(body)) + INDEX_MAGIC)
+
+
+def _header(buf: bytes) -> Tuple[List[str], int, int]:
+    """ Field names, record count and offset of the first record
+    """
+    if buf[:4] != MAGIC:
+        raise ValueError("Not a binary snapshot")
+    pos = 4
+    (n_fields,) = _U16.unpack_from(buf, pos)
+    pos += 2
+    names = []
+    for _ in range(n_fields):
+        (size,) = _U16.unpack_from(buf, pos)
+        pos += 2
+        names.append(bytes(buf[pos:pos + size]).decode())
+        pos += size
+    (count,) = _U32.unpack_from(buf, pos)
+    return names, count, pos + 4
+
+
+def _record(buf: bytes, pos: int, names: List[str]) -> Tuple[dict, int]:
+    """ Attributes of the record at pos, and the offset of the next one
+    """
+    u32, i64, f64 = _U32.unpack_from, _I64.unpack_from, _F64.unpack_from
+    attr = _ATTR.unpack_from
+    (n_attrs,) = _U16.unpack_from(buf, pos)
+    pos += 2
+    attrs = {}
+    for _ in range(n_attrs):
+        index, tag = attr(buf, pos)
+        pos += 3
+        if tag == STR:
+            (size,) = u32(buf, pos)
+            pos += 4
+            value = buf[pos:pos + size].decode()
+            pos += size
+        elif tag == DATETIME:
+            value = EPOCH + timedelta(seconds=i64(buf, pos)[0])
+            pos += 8
+        elif tag == NONE:
+            value = None
+        elif tag == INT:
+            (value,) = i64(buf, pos)
+            pos += 8
+        elif tag == FLOAT:
+            (value,) = f64(buf, pos)
+            pos += 8
+        elif tag == JSON:
+            (size,) = u32(buf, pos)
+            pos += 4
+            value = json.loads(buf[pos:pos + size])
+            pos += size
+        else:
+            value = tag == TRUE
+        attrs[names[index]] = value
+    return attrs, pos
+
+
+def load(f: BinaryIO, cls: type) -> dict:
+    """ Read a binary snapshot file into objects of cls by id, built
+        without going through __init__
+    """
+    buf = f.read()
+    names, count, pos = _header(buf)
+    objs = {}
+    for _ in range(count):
+        attrs, pos = _record(buf, pos, names)
+        objs[attrs['id']] = cls._from_attributes(attrs)
+    return objs
+
+
+def load_lazy(file_path: str, cls: type) -> Optional[LazySnapshot]:
+    """ Memory-map a binary snapshot file as a LazySnapshot of cls, None
+        if it has no index for the indexed attributes of cls
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+    end = len(buf) - _U64.size - len(INDEX_MAGIC)
+    if end < 0 or buf[end + _U64.size:] != INDEX_MAGIC:
+        buf.close()
+        return None
+    names, _, body = _header(buf)
+    (start,) = _U64.unpack_from(buf, end)
+    index = json.loads(buf[start:end])
+    try:
+        return LazySnapshot(buf, cls, names, body, index)
+    except (KeyError, TypeError):
+        # Not indexed by the attributes of cls, or by unhashable values
+        buf.close()
+        return None
+
+
+def _model(class_name: str) -> type:
+    """ Model class from its name: User -> models.user.User
+    """
+    import importlib
+    import re
+    module = re.sub(r'(?<!^)(?=[A-Z])', '_', class_name).lower()
+    return getattr(importlib.import_module("models." + module), class_name)
+
+
+def convert(class_name: str, fmt: str):
+    """ Rewrite the snapshot of a class in the format fmt
+    """
+    import os
+    os.environ["SNAPSHOT_FORMAT_{}".format(class_name)] = fmt
+    cls = _model(class_name)
+    cls.load_from_file()
+    cls.save_to_file()
+
+
+def benchmark(count: int):
+    """ Load/save time and file size of count users in each format,
+        and lazy load time, in a temporary directory
+    """
+    import os
+    import tempfile
+    import time
+    from models.base import class_lock
+    from models.user import User
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            users = {}
+            for i in range(count):
+                user = User(email="user{}@hbtn.io".format(i),
+                            first_name="First{}".format(i),
+                            last_name="Last{}".format(i))
+                user._password = "{:064x}".format(i)
+                users[user.id] = user
+            with class_lock("User").write():
+                User._swap(users)
+            for fmt in ("json", "bin"):
+                os.environ["SNAPSHOT_FORMAT_User"] = fmt
+                start = time.perf_counter()
+                User.save_to_file()
+                saved = time.perf_counter() - start
+                start = time.perf_counter()
+                User.load_from_file()
+                loaded = time.perf_counter() - start
+                size = os.path.getsize(".db_User.{}".format(fmt))
+                print("{:4s} {} users: save {:.3f}s, load {:.3f}s, "
+                      "{:.1f} MB".format(fmt, User.count(), saved, loaded,
+                                         size / 1e6))
+            os.environ["STORAGE_LAZY"] = "1"
+            start = time.perf_counter()
+            User.load_from_file()
+            loaded = time.perf_counter() - start
+            start = time.perf_counter()
+            for i in range(0, count, max(count // 1000, 1)):
+                User.search({'email': "user{}@hbtn.io".format(i)})
+            searched = time.perf_counter() - start
+            print("lazy {} users: load {:.3f}s, {} searches {:.3f}s".format(
+                User.count(), loaded, min(count, 1000), searched))
+        finally:
+            os.environ.pop("SNAPSHOT_FORMAT_User", None)
+            os.environ.pop("STORAGE_LAZY", None)
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) == 4 and sys.argv[1] == "convert":
+        convert(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "benchmark":
+        benchmark(int(sys.argv[2]))
+    else:
+        print("Usage: python3 -m models.snapshot convert <Class> json|bin\n"
+              "       python3 -m models.snapshot benchmark <count>")
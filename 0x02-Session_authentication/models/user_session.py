@@ -1,16 +1,29 @@
 #!/usr/bin/env python3
 """ User session module
 """
-from models.base import Base
+from datetime import datetime
+from models.base import Base, Interned, Timestamp, TIMESTAMP_FORMAT
 
 
 class UserSession(Base):
     """User Session Class
     """
 
+    __slots__ = ('_user_id', 'session_id', '_expires_at')
+
+    # Sessions of a user share its id string
+    user_id = Interned()
+    expires_at = Timestamp()
+
+    INDEXED_ATTRIBUTES = ('session_id', 'user_id')
+
     def __init__(self, *args: list, **kwargs: dict):
         """Constructor Method
         """
         super().__init__(*args, **kwargs)
         self.user_id = kwargs.get('user_id')
         self.session_id = kwargs.get('session_id')
+        expires_at = kwargs.get('expires_at')
+        if isinstance(expires_at, str):
+            expires_at = datetime.strptime(expires_at, TIMESTAMP_FORMAT)
+        self.expires_at = expires_at
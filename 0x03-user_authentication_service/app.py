@@ -9,6 +9,12 @@ app = Flask(__name__)
 AUTH = Auth()
 
 
+@app.teardown_appcontext
+def remove_db_session(exception=None) -> None:
+    """End the database session of the request."""
+    AUTH.remove_session()
+
+
 @app.route("/", methods=["GET"])
 def index():
     """Return a JSON payload with a welcome message."""
@@ -48,10 +54,10 @@ def logout():
     """Find user with requested session ID && destroy session
     """
     user_cookie = request.cookies.get("session_id", None)
-    user = AUTH.get_user_from_session_id(user_cookie)
-    if user_cookie is None or user is None:
+    user_id = AUTH.get_user_id_from_session_id(user_cookie)
+    if user_cookie is None or user_id is None:
         abort(403)
-    AUTH.destroy_session(user.id)
+    AUTH.destroy_session(user_id)
     return redirect('/')
 
 
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 """ Auth module """
 
-import bcrypt
+from bcrypt_pool import get_pool, get_rounds, gensalt, rounds_of
 from db import DB
+from session_cache import SessionCache
 from user import User
 from sqlalchemy.exc import NoResultFound
+from typing import Optional, Tuple
+import os
 import uuid
 
 
@@ -12,7 +15,7 @@ def _hash_password(password: str) -> bytes:
     """Hash a password using bcrypt and return
         the hashed password as bytes.
     """
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    return get_pool().hashpw(password.encode(), gensalt())
 
 
 def _generate_uuid() -> str:
@@ -27,9 +30,22 @@ class Auth:
     """
 
     def __init__(self):
-        """Initializes DB
+        """Initializes DB, the session cache and picks the bcrypt cost.
+            The cache is off unless SESSION_CACHE_SIZE sets its number of
+            entries, each kept SESSION_CACHE_TTL seconds (default 5).
+            It lives in each process: with several workers, a session
+            ended on one stays valid on the others for up to the TTL.
         """
         self._db = DB()
+        self.session_cache = SessionCache(
+            int(os.getenv("SESSION_CACHE_SIZE", 0)),
+            float(os.getenv("SESSION_CACHE_TTL", 5)))
+        get_rounds()
+
+    def remove_session(self) -> None:
+        """Ends the database session of the current thread
+        """
+        self._db.remove_session()
 
     def register_user(self, email: str, password: str) -> User:
         """Registers a new user with the given email and password.
@@ -47,10 +63,18 @@ class Auth:
     def valid_login(self, email: str, password: str) -> bool:
         """Expect email and password required arguments
             Returns a boolean
+            A valid password hashed at a lower cost than the current one
+            is rehashed, never one hashed at a higher cost.
         """
         try:
             user = self._db.find_user_by(email=email)
-            if bcrypt.checkpw(password.encode('utf-8'), user.hashed_password):
+            if get_pool().checkpw(password.encode('utf-8'),
+                                  user.hashed_password):
+                rounds = rounds_of(user.hashed_password)
+                if rounds is not None and rounds < get_rounds():
+                    self._db.update_user_by(
+                        {"id": user.id},
+                        hashed_password=_hash_password(password))
                 return True
         except NoResultFound:
             pass
@@ -60,41 +84,55 @@ class Auth:
         """Returns the session ID as a string.
         """
         session_id = _generate_uuid()
-        try:
-            user = self._db.find_user_by(email=email)
-            self._db.update_user(user.id, session_id=session_id)
-            return session_id
-        except NoResultFound:
+        if self._db.update_user_by({"email": email},
+                                   session_id=session_id) == 0:
             return None
+        self.session_cache.invalidate(email=email)
+        return session_id
 
-    def get_user_from_session_id(self, session_id: str) -> str:
-        """Returns corresponding User or None
+    def _session_user(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """Returns the (id, email) of the user of session_id or None,
+            read through the session cache
         """
+        if session_id is None:
+            return None
+        cached = self.session_cache.get(session_id)
+        if cached is not None:
+            return cached
+        generation = self.session_cache.generation
         try:
             user = self._db.find_user_by(session_id=session_id)
-            return user.email
         except NoResultFound:
             return None
+        self.session_cache.put(session_id, user.id, user.email, generation)
+        return user.id, user.email
+
+    def get_user_from_session_id(self, session_id: str) -> str:
+        """Returns corresponding User or None
+        """
+        user = self._session_user(session_id)
+        return None if user is None else user[1]
+
+    def get_user_id_from_session_id(self, session_id: str) -> int:
+        """Returns the id of the user of session_id or None
+        """
+        user = self._session_user(session_id)
+        return None if user is None else user[0]
 
     def destroy_session(self, user_id: int) -> None:
         """destroy session
         """
-        try:
-            user = self._db.find_user_by(id=user_id)
-            self._db.update_user(user.id, session_id=None)
-        except NoResultFound:
-            return None
+        self._db.update_user_by({"id": user_id}, session_id=None)
+        self.session_cache.invalidate(user_id=user_id)
 
     def get_reset_password_token(self, email: str) -> str:
         """Find user corresponding to email, raise ValueError if not exists
         """
         updated_token = _generate_uuid()
-        try:
-            user = self._db.find_user_by(email=email)
-            self._db.update_user(user.id, reset_token=updated_token)
-            return updated_token
-        except NoResultFound:
+        if self._db.update_user_by({"email": email},
+                                   reset_token=updated_token) == 0:
             raise ValueError
+        return updated_token
 
     def update_password(self, reset_token: str, password: str) -> str:
         """Takes reset_token string argument and a password string
@@ -102,10 +140,15 @@ class Auth:
         """
         if reset_token is None or password is None:
             return None
+        # Checked first so that unknown tokens cost no bcrypt hash
         try:
             user = self._db.find_user_by(reset_token=reset_token)
         except NoResultFound:
             raise ValueError
         hashed_password = _hash_password(password)
-        self._db.update_user(user.id, hashed_password=hashed_password,
-                             reset_token=None)
+        # The token is consumed by the update itself: used once at most
+        if self._db.update_user_by({"reset_token": reset_token},
+                                   hashed_password=hashed_password,
+                                   reset_token=None) == 0:
+            raise ValueError
+        self.session_cache.invalidate(user_id=user.id)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Benchmarks of the DB module: lookups with and without indexes,
+    startup on an existing database and concurrent use from threads
+"""
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from db import DB, migrate
+from user import Base, User
+
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+
+def _benchmark_db(path: str, count: int) -> Engine:
+    """Creates a SQLite database of count users at path, without the
+        indexes of the model
+    """
+    engine = create_engine(f"sqlite:///{path}")
+    User.__table__.create(engine)
+    with engine.begin() as conn:
+        for index in User.__table__.indexes:
+            conn.execute(text(f"DROP INDEX {index.name}"))
+        for start in range(0, count, 50000):
+            conn.execute(insert(User), [
+                {"email": f"user{i}@hbtn.io",
+                 "hashed_password": "x" * 60,
+                 "session_id": f"session-{i}",
+                 "reset_token": f"token-{i}" if i % 10 else None}
+                for i in range(start, min(start + 50000, count))])
+    return engine
+
+
+def benchmark_lookups() -> None:
+    """Lookup latency by each find_user_by key at 10k, 100k and 1M
+        users, without the indexes then after migrate()
+    """
+    for count in (10000, 100000, 1000000):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = _benchmark_db(f"{tmp}/benchmark.db", count)
+            session = sessionmaker(bind=engine)()
+            for label in ("no index", "indexed"):
+                if label == "indexed":
+                    migrate(engine)
+                timings = []
+                for key, value in (("email", "user{}@hbtn.io"),
+                                   ("session_id", "session-{}"),
+                                   ("reset_token", "token-{}")):
+                    # Users spread over the table, with a reset token
+                    samples = [value.format(random.randrange(count) | 1)
+                               for _ in range(50)]
+                    start = time.perf_counter()
+                    for sample in samples:
+                        session.query(User).filter_by(
+                            **{key: sample}).first()
+                    elapsed = (time.perf_counter() - start) / len(samples)
+                    timings.append(f"{key} {elapsed * 1000:8.3f} ms")
+                print(f"{count:8d} users, {label:8s}: " + ", ".join(timings))
+            session.close()
+            engine.dispose()
+
+
+def benchmark_startup() -> None:
+    """Time from engine creation to the first lookup on an existing
+        database: schema rebuilt by drop_all/create_all, as DB used to,
+        then kept by DB()
+    """
+    for count in (0, 100000, 1000000):
+        with tempfile.TemporaryDirectory() as tmp:
+            _benchmark_db(f"{tmp}/seed.db", count).dispose()
+            migrate(create_engine(f"sqlite:///{tmp}/seed.db"))
+            timings = []
+            for label in ("drop_all", "DB()"):
+                shutil.copy(f"{tmp}/seed.db", f"{tmp}/benchmark.db")
+                url = f"sqlite:///{tmp}/benchmark.db"
+                start = time.perf_counter()
+                if label == "drop_all":
+                    engine = create_engine(url)
+                    Base.metadata.drop_all(engine)
+                    Base.metadata.create_all(engine)
+                    session = sessionmaker(bind=engine)()
+                    session.query(User).filter_by(email="user1@hbtn.io") \
+                        .first()
+                    session.close()
+                else:
+                    db = DB(url)
+                    db._session.query(User).filter_by(email="user1@hbtn.io") \
+                        .first()
+                    db._session.close()
+                    engine = db._engine
+                elapsed = time.perf_counter() - start
+                engine.dispose()
+                timings.append(f"{label} {elapsed * 1000:8.1f} ms")
+            print(f"{count:8d} users: " + ", ".join(timings))
+
+
+def benchmark_threads() -> None:
+    """Lookups and updates per second on 100k users from 1, 2, 4 and 8
+        threads sharing one DB, each through its own session
+    """
+    count, operations = 100000, 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        _benchmark_db(f"{tmp}/benchmark.db", count).dispose()
+        db = DB(f"sqlite:///{tmp}/benchmark.db")
+        for workers in (1, 2, 4, 8):
+            errors = []
+
+            def work() -> None:
+                """Runs this thread's share of the operations"""
+                try:
+                    for i in range(operations // workers):
+                        user = db.find_user_by(
+                            session_id=f"session-{random.randrange(count)}")
+                        if i % 10 == 0:
+                            db.update_user(user.id,
+                                           reset_token=str(uuid.uuid4()))
+                finally:
+                    db.remove_session()
+
+            def run() -> None:
+                """Records the error of a thread, if any"""
+                try:
+                    work()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=run) for _ in range(workers)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            print(f"{workers} threads: {operations / elapsed:8.0f} ops/s, "
+                  f"{len(errors)} errors")
+        db._engine.dispose()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["lookups"]:
+        benchmark_lookups()
+    elif sys.argv[1:] == ["startup"]:
+        benchmark_startup()
+    elif sys.argv[1:] == ["threads"]:
+        benchmark_threads()
+    else:
+        print("Usage: python3 bench_db.py lookups|startup|threads")
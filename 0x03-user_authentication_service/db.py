@@ -2,37 +2,123 @@
 """DB module
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, update
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.session import Session
+from sqlalchemy.pool import QueuePool, StaticPool
 
 from user import Base, User
 
-from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
+from typing import List
+import os
+
+SQLITE_JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL",
+                        "OFF")
+SQLITE_SYNCHRONOUS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def configure_sqlite(engine: Engine) -> None:
+    """Sets the pragmas of each new connection of a SQLite engine:
+        DB_SQLITE_JOURNAL_MODE (default WAL), DB_SQLITE_SYNCHRONOUS
+        (default NORMAL) and DB_SQLITE_MMAP_SIZE (bytes, default 256 MiB,
+        0 to disable).
+    """
+    journal_mode = os.getenv("DB_SQLITE_JOURNAL_MODE", "WAL").upper()
+    synchronous = os.getenv("DB_SQLITE_SYNCHRONOUS", "NORMAL").upper()
+    mmap_size = int(os.getenv("DB_SQLITE_MMAP_SIZE", 1 << 28))
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"Invalid SQLite journal mode: {journal_mode}")
+    if synchronous not in SQLITE_SYNCHRONOUS:
+        raise ValueError(f"Invalid SQLite synchronous: {synchronous}")
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        """Runs the pragmas on a new connection
+        """
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute(f"PRAGMA mmap_size={mmap_size}")
+        finally:
+            cursor.close()
+
+
+def migrate(engine: Engine) -> List[str]:
+    """Brings an existing schema up to date with the models without
+        dropping data: creates missing tables, then the missing indexes
+        of existing ones. Returns the names of the indexes created.
+        Raises ValueError if a unique index cannot be created because
+        of duplicate values.
+    """
+    Base.metadata.create_all(engine)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in
+                    inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(engine)
+            except IntegrityError as e:
+                raise ValueError(
+                    f"Cannot create {index.name}, duplicate values in "
+                    f"{table.name}: {e.orig}") from e
+            created.append(index.name)
+    return created
 
 
 class DB:
     """DB class
     """
 
-    def __init__(self) -> None:
-        """Initialize a new DB instance
+    def __init__(self, url: str = None) -> None:
+        """Initialize a new DB instance on url, else DB_URL, else
+            sqlite:///a.db.
+            Connections are pooled: DB_POOL_SIZE (default 5) kept open,
+            up to DB_POOL_OVERFLOW (default 10) more, waiting at most
+            DB_POOL_TIMEOUT seconds (default 30) for one. An in-memory
+            SQLite database is a single connection shared by all threads.
+            The schema is created or migrated, its data kept across
+            restarts unless DB_RESET=1.
         """
-        self._engine = create_engine("sqlite:///a.db", echo=False)
-        Base.metadata.drop_all(self._engine)
-        Base.metadata.create_all(self._engine)
-        self.__session = None
+        url = make_url(url or os.getenv("DB_URL", "sqlite:///a.db"))
+        if url.get_backend_name() == "sqlite" and \
+                url.database in (None, "", ":memory:"):
+            options = {"poolclass": StaticPool,
+                       "connect_args": {"check_same_thread": False}}
+        else:
+            options = {"poolclass": QueuePool,
+                       "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+                       "max_overflow": int(os.getenv("DB_POOL_OVERFLOW", 10)),
+                       "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+                       "pool_pre_ping": url.get_backend_name() != "sqlite"}
+        self._engine = create_engine(url, echo=False, **options)
+        if self._engine.dialect.name == "sqlite":
+            configure_sqlite(self._engine)
+        if os.getenv("DB_RESET") == "1":
+            Base.metadata.drop_all(self._engine)
+        migrate(self._engine)
+        # Objects stay readable after commit, their session is per thread
+        self._sessions = scoped_session(
+            sessionmaker(bind=self._engine, expire_on_commit=False))
 
     @property
     def _session(self) -> Session:
-        """Memoized session object
+        """Session of the current thread, opened on first use
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        return self._sessions()
+
+    def remove_session(self) -> None:
+        """Closes the session of the current thread, returning its
+            connection to the pool. The next use opens a new one.
+        """
+        self._sessions.remove()
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """Adds a user to the database and returns the User object.
@@ -45,26 +131,53 @@ class DB:
 
     def find_user_by(self, **kwargs) -> User:
         """Finds a user based on arbitrary keyword arguments.
+            The user is read afresh even if the session of the thread
+            already holds it, and the read transaction is ended so that
+            the next lookup sees the commits made meanwhile.
         """
         try:
-            user = self._session.query(User).filter_by(**kwargs).first()
+            user = self._session.query(User).filter_by(**kwargs) \
+                .populate_existing().first()
             if not user:
                 raise NoResultFound
             return user
         except AttributeError:
             raise InvalidRequestError
+        finally:
+            # Objects are not expired on commit, user stays readable
+            self._session.commit()
 
     def update_user(self, user_id: int, **kwargs) -> None:
         """Update a user's attributes and commit changes to the database.
         """
-        try:
-            user = self.find_user_by(id=user_id)
+        if not kwargs:
+            try:
+                self.find_user_by(id=user_id)
+            except NoResultFound:
+                raise ValueError(f"User with id {user_id} not found")
+            return
+        if self.update_user_by({"id": user_id}, **kwargs) == 0:
+            raise ValueError(f"User with id {user_id} not found")
 
-            for key, value in kwargs.items():
-                if not hasattr(user, key):
-                    raise ValueError(f"Invalid attribute: {key}")
-                setattr(user, key, value)
+    def update_user_by(self, where: dict, **kwargs) -> int:
+        """Sets the attributes kwargs of the users matching all of where,
+            e.g. {"email": email}, in a single UPDATE statement committed
+            at once. Returns the number of users updated.
+        """
+        columns = User.__table__.columns.keys()
+        if not where or any(key not in columns for key in where):
+            raise InvalidRequestError
+        if not kwargs:
+            raise ValueError("No attribute to update")
+        for key in kwargs:
+            if key not in columns:
+                raise ValueError(f"Invalid attribute: {key}")
 
+        statement = update(User).filter_by(**where).values(**kwargs)
+        try:
+            result = self._session.execute(statement)
             self._session.commit()
-        except NoResultFound:
-            raise ValueError(f"User with id {user_id} not found")
+        except Exception:
+            self._session.rollback()
+            raise
+        return result.rowcount
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+""" In-process cache of session lookups """
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+import threading
+import time
+
+
+class SessionCache:
+    """ Bounded LRU of session ID -> (user ID, email), each entry kept at
+        most ttl seconds. A user has a single session: caching a new one
+        drops the former, and invalidating a user by ID or email drops
+        its session. Lookups racing an invalidation are not cached.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60):
+        """ Starts empty. """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._by_user_id = {}
+        self._by_email = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """ (user ID, email) of a cached session, None on a miss. """
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[2] < time.monotonic():
+                self._drop(session_id)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, session_id: str, user_id: int, email: str,
+            generation: int) -> None:
+        """ Caches a session read from the database while the cache was
+            at generation, unless invalidated since.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            former = self._by_user_id.get(user_id)
+            if former is not None and former != session_id:
+                self._drop(former)
+            self._entries[session_id] = (user_id, email,
+                                         time.monotonic() + self.ttl)
+            self._entries.move_to_end(session_id)
+            self._by_user_id[user_id] = session_id
+            self._by_email[email] = session_id
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, user_id: int = None, email: str = None) -> None:
+        """ Drops the session of a user, given its ID or email. """
+        with self._lock:
+            self.generation += 1
+            for session_id in (self._by_user_id.get(user_id),
+                               self._by_email.get(email)):
+                if session_id is not None:
+                    self._drop(session_id)
+
+    def _drop(self, session_id: str) -> None:
+        """ Removes an entry and its user mappings, lock held. """
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return
+        user_id, email, _ = entry
+        if self._by_user_id.get(user_id) == session_id:
+            del self._by_user_id[user_id]
+        if self._by_email.get(email) == session_id:
+            del self._by_email[email]